@@ -10,11 +10,23 @@
 5. 逆順で再圧縮
 """
 
+import argparse
+import contextlib
+import io
+import logging
+import multiprocessing
+import os
+import queue
 import shutil
 import sys
 import tempfile
+import threading
+import traceback
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait
+from itertools import islice
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 # ローカルモジュールのインポート
 sys.path.insert(0, str(Path(__file__).parent))
@@ -22,10 +34,44 @@ from zip_utils import (
     verify_python_version,
     safe_extract,
     compress_directory,
+    merge_zip,
     add_signature_marker,
     list_zip_contents,
 )
 
+# tmpfs上の作業ディレクトリ（Linuxのみ）と、展開に必要な容量の見積もり係数
+SHM_DIR = "/dev/shm"
+WORK_SPACE_FACTOR = 3
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """常に現在のsys.stdoutへ出力するハンドラ（ワーカーのredirect_stdoutに追従）"""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+def _init_logging(level: int) -> None:
+    """
+    ファイル単位の詳細ログの出力先とレベルを設定
+
+    メインプロセスとProcessPoolExecutorの各ワーカー（initializer）で呼び出す。
+
+    Args:
+        level: ログレベル（logging.DEBUGで解凍・圧縮した各ファイルを表示）
+    """
+    logging.basicConfig(level=level, format="%(message)s", handlers=[_StdoutHandler()], force=True)
+
+
+def _worker_initargs() -> Tuple[int]:
+    """ワーカープロセスに引き継ぐ_init_loggingの引数"""
+    return (logging.getLogger().getEffectiveLevel(),)
+
 
 def find_zip_files(directory: Path, pattern: str = "*.zip") -> List[Path]:
     """
@@ -58,8 +104,20 @@ def process_xcframework_zip(xcfw_zip: Path, work_dir: Path) -> None:
     # 1. xcframework.zip を解凍
     safe_extract(xcfw_zip, xcfw_dir)
 
+    # 2-4. 署名→再圧縮→解凍ディレクトリ削除
+    sign_and_recompress_xcframework(xcfw_zip, xcfw_dir)
+
+
+def sign_and_recompress_xcframework(xcfw_zip: Path, xcfw_dir: Path) -> None:
+    """
+    解凍済みのxcframeworkに署名マーカーを追加して再圧縮
+
+    Args:
+        xcfw_zip: 出力先のxcframework.zipファイルのパス（元ファイルを上書き）
+        xcfw_dir: 解凍済みxcframeworkディレクトリ
+    """
     # 2. 署名済みマーカーを追加
-    print(f"✍️  Adding signature marker to {xcfw_name}")
+    print(f"✍️  Adding signature marker to {xcfw_dir.name}")
     add_signature_marker(xcfw_dir)
 
     # 3. 再圧縮
@@ -71,13 +129,96 @@ def process_xcframework_zip(xcfw_zip: Path, work_dir: Path) -> None:
     print()
 
 
-def process_connect_zip(connect_zip: Path, work_dir: Path) -> None:
+def process_xcframework_zips_pipelined(xcfw_zips: List[Path]) -> None:
+    """
+    xcframework.zipを解凍と署名・再圧縮の2段パイプラインで処理
+
+    解凍スレッドが次のxcframeworkを展開している間に、
+    メインスレッドで前のxcframeworkを署名・再圧縮する
+    （zlibの圧縮・解凍処理はGILを解放するため並行に進む）。
+    キューの上限で同時に展開されるxcframeworkの数（ディスク使用量）を抑える。
+
+    Args:
+        xcfw_zips: 処理するxcframework.zipファイルのリスト
+    """
+    extracted: "queue.Queue[object]" = queue.Queue(maxsize=2)
+    stop = threading.Event()
+    done = object()
+
+    def _extract_worker() -> None:
+        # 解凍ログはメインスレッドの署名・再圧縮のログと混ざらないよう、
+        # バッファに集めてxcframeworkごとにキューで渡し、メインスレッドで表示する
+        log_buf = io.StringIO()
+        try:
+            for xcfw_zip in xcfw_zips:
+                if stop.is_set():
+                    break
+                log_buf = io.StringIO()
+                xcfw_dir = xcfw_zip.parent / xcfw_zip.stem
+                safe_extract(xcfw_zip, xcfw_dir, out=log_buf)
+                extracted.put((log_buf.getvalue(), (xcfw_zip, xcfw_dir)))
+        except BaseException as e:
+            extracted.put((log_buf.getvalue(), e))
+        finally:
+            extracted.put(done)
+
+    extractor = threading.Thread(target=_extract_worker, name="xcframework-extractor", daemon=True)
+    extractor.start()
+
+    item = None
+    try:
+        while (item := extracted.get()) is not done:
+            log_text, payload = item
+            print(log_text, end="")
+            if isinstance(payload, BaseException):
+                raise payload
+            sign_and_recompress_xcframework(*payload)
+    finally:
+        # エラー時は解凍スレッドを止め、キューを空にして終了を待つ
+        stop.set()
+        while item is not done:
+            item = extracted.get()
+        extractor.join()
+
+
+def _process_xcframework_worker(xcfw_zip: Path) -> Tuple[bool, str]:
+    """
+    ワーカープロセスでxcframework.zipを処理し、ログ出力をまとめて返す
+
+    並列実行時にログが混ざらないよう、標準出力をバッファに集めて
+    親プロセス側でxcframeworkごとにまとめて表示する。
+    失敗した場合もそこまでのログとエラー内容を返す。
+
+    Args:
+        xcfw_zip: xcframework.zipファイルのパス
+
+    Returns:
+        (成功したかどうか, 処理中に出力されたログ)
+    """
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        try:
+            process_xcframework_zip(xcfw_zip, xcfw_zip.parent)
+        except Exception as e:
+            print(f"\n❌ Error processing {xcfw_zip.name}:")
+            print(f"   {type(e).__name__}: {e}")
+            traceback.print_exc(file=sys.stdout)
+            return False, buf.getvalue()
+    return True, buf.getvalue()
+
+
+def process_connect_zip(
+    connect_zip: Path,
+    work_dir: Path,
+    pool: Optional[ProcessPoolExecutor] = None
+) -> None:
     """
     コネクト_vXX.YY.ZZ.zipを処理
 
     Args:
         connect_zip: コネクトZIPファイルのパス
         work_dir: 作業ディレクトリ
+        pool: xcframework.zipを並列処理する共有プロセスプール（Noneの場合はスレッドパイプラインで処理）
     """
     connect_name = connect_zip.stem
     connect_dir = work_dir / connect_name
@@ -103,11 +244,29 @@ def process_connect_zip(connect_zip: Path, work_dir: Path) -> None:
     xcfw_zips = list(nested_dir.rglob("*.xcframework.zip"))
     print(f"🔍 Found {len(xcfw_zips)} xcframework.zip files")
 
-    for xcfw_zip in xcfw_zips:
-        process_xcframework_zip(xcfw_zip, xcfw_zip.parent)
-
-    # 4. コネクトZIPを再圧縮
-    compress_directory(connect_dir, connect_zip, base_path=connect_dir)
+    # 各xcframeworkは独立しているため、共有プロセスプールがあれば並列で処理
+    if pool is not None and len(xcfw_zips) > 1:
+        print("⚙️  Processing in parallel (process pool)\n")
+        futures = [pool.submit(_process_xcframework_worker, xcfw_zip) for xcfw_zip in xcfw_zips]
+        try:
+            for xcfw_zip, future in zip(xcfw_zips, futures):
+                ok, log = future.result()
+                print(log, end="")
+                if not ok:
+                    raise RuntimeError(f"Failed to process {xcfw_zip.name}")
+        finally:
+            # 失敗時は未開始の処理を取り消し、実行中のワーカーの終了を待ってから戻る
+            # （呼び出し元が作業ディレクトリを削除した後にワーカーが書き込み続けないように）
+            for future in futures:
+                future.cancel()
+            wait(futures)
+    else:
+        process_xcframework_zips_pipelined(xcfw_zips)
+
+    # 4. コネクトZIPを再作成（変更したxcframework.zip以外は圧縮済みデータをそのままコピー）
+    # 再圧縮したxcframework.zipは圧縮済みのため、二重にDEFLATEせずSTOREDで格納
+    changed = [xcfw_zip.relative_to(connect_dir).as_posix() for xcfw_zip in xcfw_zips]
+    merge_zip(connect_zip, connect_zip, connect_dir, changed, compress_type=zipfile.ZIP_STORED)
 
     # 5. 解凍ディレクトリを削除
     print(f"🗑️  Cleaning up: {connect_dir.name}")
@@ -115,10 +274,49 @@ def process_connect_zip(connect_zip: Path, work_dir: Path) -> None:
     print()
 
 
+def select_work_root(root_zips: List[Path]) -> str:
+    """
+    作業ディレクトリの親ディレクトリを選択
+
+    環境変数 ZIP_WORKDIR があればそれを使う。なければ中間ファイルの読み書きを
+    メモリ上で済ませるため /dev/shm（tmpfs）を優先し、存在しない（macOSなど）か
+    展開後のサイズに対して空き容量が足りない場合は /tmp を使う。
+
+    複数のルートZIPを並列処理する場合は、各ワーカーが同じ空き容量を見て /dev/shm を選び
+    合計でRAMを使い切らないよう、全ルートZIPの合計サイズで1回だけ判定すること。
+
+    Args:
+        root_zips: 同時に処理するルートZIPファイル（展開後サイズの見積もりに使用）
+
+    Returns:
+        作業ディレクトリを作成する親ディレクトリ
+    """
+    env_dir = os.environ.get("ZIP_WORKDIR")
+    if env_dir:
+        return env_dir
+
+    if os.path.isdir(SHM_DIR):
+        # ルート・コネクト・xcframeworkの各階層が同時に展開されるため余裕を持って見積もる
+        required = 0
+        for root_zip in root_zips:
+            try:
+                with zipfile.ZipFile(root_zip, "r") as zf:
+                    required += sum(info.file_size for info in zf.infolist()) * WORK_SPACE_FACTOR
+            except (zipfile.BadZipFile, OSError):
+                # 読めないZIPはそのZIP自体の処理でエラーとして報告されるため、見積もりから除外
+                continue
+        if shutil.disk_usage(SHM_DIR).free > required:
+            return SHM_DIR
+
+    return "/tmp"
+
+
 def process_root_zip(
     root_zip: Path,
     output_dir: Path,
-    work_dir: Optional[Path] = None
+    work_dir: Optional[Path] = None,
+    pool: Optional[ProcessPoolExecutor] = None,
+    work_root: Optional[str] = None
 ) -> Path:
     """
     ルートZIPファイル（YYYYMMDD_text.zip）を処理
@@ -127,6 +325,8 @@ def process_root_zip(
         root_zip: 処理するルートZIPファイル
         output_dir: 出力ディレクトリ（signed/）
         work_dir: 作業ディレクトリ（Noneの場合は自動作成）
+        pool: xcframework.zipを並列処理する共有プロセスプール
+        work_root: 作業ディレクトリを作成する親ディレクトリ（Noneの場合はこのZIPのサイズから選択）
 
     Returns:
         出力されたZIPファイルのパス
@@ -138,8 +338,10 @@ def process_root_zip(
     # 作業ディレクトリの準備
     cleanup_work_dir = False
     if work_dir is None:
-        # /tmp直下で作業（パス長対策）
-        work_dir = Path(tempfile.mkdtemp(dir='/tmp', prefix='zip_'))
+        # /dev/shm（tmpfs）または/tmp直下で作業（パス長対策）
+        if work_root is None:
+            work_root = select_work_root([root_zip])
+        work_dir = Path(tempfile.mkdtemp(dir=work_root, prefix='zip_'))
         cleanup_work_dir = True
         print(f"📁 Work directory: {work_dir}\n")
 
@@ -170,26 +372,29 @@ def process_root_zip(
         if not connect_dir.exists():
             raise FileNotFoundError(
                 f"Cannot find 'connect/バイナリ' in {root_zip.name}\n"
-                f"Available structure:\n{list(root_dir.rglob('*'))[:10]}"
+                f"Available structure:\n{list(islice(root_dir.rglob('*'), 10))}"
             )
 
         # 3. コネクトZIPファイルを処理
         connect_zips = find_zip_files(connect_dir, "コネクト_*.zip")
         print(f"🔍 Found {len(connect_zips)} connect ZIP files\n")
 
+        changed = []
         for connect_zip in connect_zips:
             # コネクト_3rd は無視（要件に含まれていない）
             if "3rd" in connect_zip.name:
                 print(f"⏭️  Skipping: {connect_zip.name} (3rd party)\n")
                 continue
 
-            process_connect_zip(connect_zip, connect_dir)
+            process_connect_zip(connect_zip, connect_dir, pool=pool)
+            changed.append(connect_zip.resolve().relative_to(root_dir.resolve()).as_posix())
 
-        # 4. ルートZIPを再圧縮
+        # 4. ルートZIPを再作成（処理したコネクトZIP以外は圧縮済みデータをそのままコピー）
+        # 再作成したコネクトZIPはSTOREDで格納
         output_dir.mkdir(parents=True, exist_ok=True)
         output_zip = output_dir / root_zip.name
 
-        compress_directory(root_dir, output_zip, base_path=root_dir)
+        merge_zip(root_zip, output_zip, root_dir, changed, compress_type=zipfile.ZIP_STORED)
 
         # 5. 解凍ディレクトリを削除
         print(f"🗑️  Cleaning up: {root_dir.name}")
@@ -208,21 +413,82 @@ def process_root_zip(
             shutil.rmtree(work_dir)
 
 
+def _process_root_zip_worker(root_zip: Path, output_dir: Path, work_root: str) -> Tuple[Optional[Path], str]:
+    """
+    ワーカープロセスでルートZIPを処理し、ログ出力をまとめて返す
+
+    ワーカー内ではプロセスプールを入れ子にせず、xcframeworkはスレッドパイプラインで処理する。
+
+    Args:
+        root_zip: 処理するルートZIPファイル
+        output_dir: 出力ディレクトリ（signed/）
+        work_root: 作業ディレクトリを作成する親ディレクトリ（main()で全ルートZIPに対して選択したもの）
+
+    Returns:
+        (出力されたZIPファイルのパス（失敗時はNone）, 処理中に出力されたログ)
+    """
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        try:
+            output_zip = process_root_zip(root_zip, output_dir, work_root=work_root)
+        except Exception as e:
+            print(f"\n❌ Error processing {root_zip.name}:")
+            print(f"   {type(e).__name__}: {e}")
+            traceback.print_exc(file=sys.stdout)
+            output_zip = None
+    return output_zip, buf.getvalue()
+
+
+def create_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    実行全体で共有するプロセスプールを作成
+
+    forkserverが使える環境では、import済みのサーバープロセスからワーカーをforkして
+    ワーカーごとのインタプリタ起動・モジュールimportのコストを抑える。
+
+    Args:
+        max_workers: ワーカープロセス数
+
+    Returns:
+        プロセスプール
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else None
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context(method),
+        initializer=_init_logging,
+        initargs=_worker_initargs(),
+    )
+
+
 def main():
     """メイン処理"""
     verify_python_version()
 
     # コマンドライン引数の処理
-    if len(sys.argv) < 2:
-        print("Usage: python process_zip.py <input_zip_or_dir> [output_dir]")
-        print()
-        print("Examples:")
-        print("  python process_zip.py unsign/20260105_text.zip signed/")
-        print("  python process_zip.py unsign/ signed/")
-        sys.exit(1)
-
-    input_path = Path(sys.argv[1])
-    output_dir = Path(sys.argv[2]) if len(sys.argv) > 2 else Path("signed")
+    parser = argparse.ArgumentParser(
+        description="ネストしたZIPファイルを解凍→署名→再圧縮",
+        epilog=(
+            "Examples:\n"
+            "  python process_zip.py unsign/20260105_text.zip signed/\n"
+            "  python process_zip.py unsign/ signed/ --jobs 4"
+        ),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("input_path", type=Path, help="入力ZIPファイルまたはディレクトリ")
+    parser.add_argument("output_dir", type=Path, nargs="?", default=Path("signed"), help="出力ディレクトリ（デフォルト: signed）")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="ルートZIP・xcframework.zipの並列処理数（デフォルト: CPUコア数）"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="解凍・圧縮した各ファイルを表示")
+    args = parser.parse_args()
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be 1 or greater")
+
+    _init_logging(logging.DEBUG if args.verbose else logging.INFO)
+
+    input_path = args.input_path
+    output_dir = args.output_dir
 
     if not input_path.exists():
         print(f"❌ Error: Input path not found: {input_path}")
@@ -237,21 +503,56 @@ def main():
 
     print(f"\n📦 Found {len(zip_files)} ZIP file(s) to process\n")
 
-    # 各ZIPファイルを処理
-    for zip_file in zip_files:
-        try:
-            output_zip = process_root_zip(zip_file, output_dir)
+    # プロセスプールは実行全体で1つだけ作成し、ルートZIP・xcframeworkの処理で共有
+    jobs = args.jobs or os.cpu_count() or 1
+    pool = create_process_pool(jobs) if jobs > 1 else None
+    failed = []
 
-            # 結果の確認（オプション）
-            if output_zip.exists():
-                list_zip_contents(output_zip)
+    try:
+        if pool is None or len(zip_files) == 1:
+            # 各ZIPファイルを順に処理（xcframeworkはプールで並列処理）
+            for zip_file in zip_files:
+                try:
+                    output_zip = process_root_zip(zip_file, output_dir, pool=pool)
+
+                    # 結果の確認（オプション）
+                    if output_zip.exists():
+                        list_zip_contents(output_zip)
+
+                except Exception as e:
+                    print(f"\n❌ Error processing {zip_file.name}:")
+                    print(f"   {type(e).__name__}: {e}")
+                    traceback.print_exc()
+                    failed.append(zip_file)
+        else:
+            # ルートZIPごとに作業ディレクトリが独立しているため、プロセス並列で処理
+            print(f"⚙️  Processing root ZIPs in parallel ({min(jobs, len(zip_files))} workers)\n")
+
+            # 作業場所は全ルートZIPの合計サイズで1回だけ選ぶ（各ワーカーが個別に/dev/shmを選ばないように）
+            work_root = select_work_root(zip_files)
+            print(f"📁 Work root: {work_root}\n")
+
+            futures = {
+                pool.submit(_process_root_zip_worker, zip_file, output_dir, work_root): zip_file for zip_file in zip_files
+            }
+            for future in as_completed(futures):
+                output_zip, log = future.result()
+                print(log, end="")
+
+                if output_zip is None:
+                    failed.append(futures[future])
+                elif output_zip.exists():
+                    # 結果の確認（オプション）
+                    list_zip_contents(output_zip)
+    finally:
+        if pool is not None:
+            pool.shutdown()
 
-        except Exception as e:
-            print(f"\n❌ Error processing {zip_file.name}:")
-            print(f"   {type(e).__name__}: {e}")
-            import traceback
-            traceback.print_exc()
-            sys.exit(1)
+    if failed:
+        print(f"\n❌ Failed to process {len(failed)} file(s):")
+        for zip_file in failed:
+            print(f"   - {zip_file.name}")
+        sys.exit(1)
 
     print("\n✅ All files processed successfully!")
 
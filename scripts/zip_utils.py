@@ -5,11 +5,55 @@ ZIP操作ユーティリティ - UTF-8対応とWindows互換性
 Windows環境で日本語ファイル名を正しく表示できるようにします。
 """
 
+import copy
+import errno
+import logging
 import os
+import shutil
+import struct
 import sys
+import time
 import zipfile
+import zlib
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Iterable, Iterator, Optional, TextIO, Tuple
+
+# ファイル単位の詳細ログ（-v指定時のみ表示）
+log = logging.getLogger(__name__)
+
+# 環境変数 ZIP_USE_ISAL=1 で、ISA-L（isal）が利用可能ならzipfileのDEFLATE/CRC32バックエンドを差し替える
+# zipfileは zlib.compressobj / zlib.decompressobj / crc32 をモジュール経由で参照するため、
+# zipfileモジュール内の参照だけを置き換えれば標準のzlibには影響しない
+# ISA-Lは高速だが圧縮率は標準zlib（レベル6）より低く、出力サイズが1〜2割程度大きくなるため明示的に有効化する
+isal_zlib = None
+if os.environ.get("ZIP_USE_ISAL", "") not in ("", "0", "false"):
+    try:
+        from isal import isal_zlib
+    except ImportError:  # 未インストール時は標準ライブラリのzlibを使用
+        pass
+
+if isal_zlib is not None:
+    zipfile.zlib = isal_zlib
+    zipfile.crc32 = isal_zlib.crc32
+
+# DEFLATEの圧縮レベル（ISA-Lの既定レベル2ではなく最大レベル3を使う。標準zlibでは既定値）
+_COMPRESS_LEVEL = isal_zlib.ISAL_BEST_COMPRESSION if isal_zlib is not None else None
+
+# 圧縮が効かないファイル（署名済みバイナリなど）をSTOREDで格納する判定用
+_STORE_PROBE_SIZE = 4096  # 圧縮率を見積もる先頭サンプルのサイズ
+_STORE_RATIO_THRESHOLD = 0.95  # サンプルの圧縮後サイズがこの比率以上ならSTORED
+# 圧縮済み形式の拡張子（常にSTORED）
+_STORED_SUFFIXES = (".zip", ".jar", ".xz", ".gz", ".zst", ".7z", ".png", ".jpg", ".jpeg")
+
+_COPY_CHUNK_SIZE = 1024 * 1024  # 圧縮済みエントリをコピーする際のチャンクサイズ
+# os.copy_file_rangeが使えない場合のエラー（別ファイルシステム間、未対応のカーネル・ファイルシステムなど）
+_COPY_FILE_RANGE_FALLBACK_ERRNOS = frozenset(
+    {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EPERM}
+)
+
+_STREAM_THRESHOLD = 16 * 1024 * 1024  # これより大きいファイルはストリームで圧縮
+_STREAM_CHUNK_SIZE = 4 * 1024 * 1024  # ストリーム圧縮時の読み込みチャンクサイズ
+_WRITE_BUFFER_SIZE = 1024 * 1024  # 出力ZIPファイルの書き込みバッファサイズ
 
 
 def verify_python_version() -> None:
@@ -21,13 +65,14 @@ def verify_python_version() -> None:
         )
 
 
-def safe_extract(zip_path: Path, extract_to: Path) -> None:
+def safe_extract(zip_path: Path, extract_to: Path, out: Optional[TextIO] = None) -> None:
     """
     ZIPファイルを安全に解凍（パストラバーサル対策付き）
 
     Args:
         zip_path: 解凍するZIPファイルのパス
         extract_to: 解凍先ディレクトリ
+        out: 進捗の出力先（Noneの場合は標準出力。別スレッドから呼ぶ際にログをまとめるために指定）
 
     Raises:
         ValueError: パストラバーサル攻撃を検出した場合
@@ -35,21 +80,118 @@ def safe_extract(zip_path: Path, extract_to: Path) -> None:
     extract_to = extract_to.resolve()
     extract_to.mkdir(parents=True, exist_ok=True)
 
-    print(f"📦 Extracting: {zip_path.name}")
-    print(f"   → {extract_to}")
+    print(f"📦 Extracting: {zip_path.name}", file=out)
+    print(f"   → {extract_to}", file=out)
+    verbose = out is not None and log.isEnabledFor(logging.DEBUG)
 
     with zipfile.ZipFile(zip_path, "r") as zf:
-        for member in zf.namelist():
-            # パストラバーサル対策
-            member_path = (extract_to / member).resolve()
-            if not str(member_path).startswith(str(extract_to)):
+        members = zf.namelist()
+
+        # パストラバーサル対策（解凍前に全エントリ名を文字列操作のみで検証）
+        # 末尾に区切り文字を付けて比較し、/tmp/foo と /tmp/foobar のような前方一致の誤判定を防ぐ
+        root = os.path.join(str(extract_to), "")
+        for member in members:
+            member_path = os.path.normpath(os.path.join(root, member))
+            if not (member_path + os.sep).startswith(root):
                 raise ValueError(f"Path traversal detected: {member} -> {member_path}")
+            if out is None:
+                log.debug("   ✓ %s", member)
+            elif verbose:
+                print(f"   ✓ {member}", file=out)
+
+        # 検証済みのエントリを一括で解凍
+        zf.extractall(extract_to, members=members)
+
+    print(f"   ✅ Extracted {len(members)} files\n", file=out)
 
-            # 解凍実行
-            zf.extract(member, extract_to)
-            print(f"   ✓ {member}")
 
-    print(f"   ✅ Extracted {len(zf.namelist())} files\n")
+def _iter_files(directory: str, prefix: str) -> Iterator[Tuple[os.DirEntry, str]]:
+    """
+    ディレクトリ配下のファイルを再帰的に列挙（os.scandirでstat呼び出しを削減）
+
+    シンボリックリンクのディレクトリは辿らない（os.walkのデフォルトと同じ）。
+
+    Args:
+        directory: 列挙するディレクトリ
+        prefix: アーカイブ名の接頭辞（例: 'aaa.xcframework/'）
+
+    Yields:
+        (DirEntry, POSIX形式のアーカイブ名) のタプル
+    """
+    subdirs = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry)
+            elif entry.is_file():
+                yield entry, prefix + entry.name
+
+    # os.walkと同じく、ファイルを先に列挙してからサブディレクトリへ降りる
+    for entry in subdirs:
+        yield from _iter_files(entry.path, f"{prefix}{entry.name}/")
+
+
+def _should_store(arcname: str, sample: bytes) -> bool:
+    """
+    DEFLATEしても縮まない（圧縮済み・高エントロピーな）データか判定
+
+    Args:
+        arcname: アーカイブ名（拡張子で圧縮済み形式を判定）
+        sample: ファイル先頭のバイト列
+
+    Returns:
+        ZIP_STOREDで格納すべき場合はTrue
+    """
+    # ネストしたZIPや画像など圧縮済み形式はサンプルを見るまでもなくSTORED
+    if arcname.lower().endswith(_STORED_SUFFIXES):
+        return True
+    # 小さいファイルはDEFLATEのコストが無視できるため常に圧縮
+    if len(sample) < _STORE_PROBE_SIZE:
+        return False
+    probe = sample[:_STORE_PROBE_SIZE]
+    return len(zlib.compress(probe, 1)) >= len(probe) * _STORE_RATIO_THRESHOLD
+
+
+def _add_file(
+    zf: zipfile.ZipFile, path: str, arcname: str, st: os.stat_result, compress_type: Optional[int] = None
+) -> None:
+    """
+    ファイルをUTF-8フラグ付きでZIPに追加
+
+    Args:
+        zf: 書き込み先のZipFile
+        path: 追加するファイルのパス
+        arcname: アーカイブ名（POSIX形式）
+        st: ファイルのstat結果
+        compress_type: 圧縮方式（Noneの場合はファイル先頭のサンプルから自動判定）
+    """
+    # ZipInfoを使ってUTF-8フラグを明示的に設定
+    # （ZipInfo.from_fileのパス解析・statを省き、呼び出し側のstat結果を使う）
+    zip_info = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[:6])
+    zip_info.external_attr = (st.st_mode & 0xFFFF) << 16
+    zip_info.file_size = st.st_size
+    zip_info.flag_bits |= 0x800  # UTF-8フラグを強制設定
+    # ZipInfoを渡した場合はZipFileのcompresslevelが使われないため、エントリごとに指定
+    zip_info._compresslevel = _COMPRESS_LEVEL
+
+    # ファイル内容を読み込んで追加（圧縮が効かないデータはSTOREDで格納）
+    with open(path, "rb") as f:
+        if st.st_size <= _STREAM_THRESHOLD:
+            data = f.read()
+            if compress_type is None:
+                compress_type = zipfile.ZIP_STORED if _should_store(arcname, data) else zipfile.ZIP_DEFLATED
+            zip_info.compress_type = compress_type
+            zf.writestr(zip_info, data, compress_type=compress_type)
+            return
+
+        # 大きなファイル（署名済みdylibなど）は全体をメモリに載せず大きめのチャンクでストリーム圧縮
+        sample = f.read(_STORE_PROBE_SIZE)
+        if compress_type is None:
+            compress_type = zipfile.ZIP_STORED if _should_store(arcname, sample) else zipfile.ZIP_DEFLATED
+        zip_info.compress_type = compress_type
+        with zf.open(zip_info, "w") as dst:
+            dst.write(sample)
+            shutil.copyfileobj(f, dst, _STREAM_CHUNK_SIZE)
 
 
 def compress_directory(source_dir: Path, output_zip: Path, base_path: Optional[Path] = None) -> None:
@@ -76,36 +218,207 @@ def compress_directory(source_dir: Path, output_zip: Path, base_path: Optional[P
     print(f"📦 Compressing: {source_dir.name}")
     print(f"   → {output_zip.name}")
 
+    # source_dirのbase_pathからの相対パスをアーカイブ名の接頭辞にする
+    prefix = source_dir.relative_to(base_path).as_posix()
+    prefix = "" if prefix == "." else prefix + "/"
+
     file_count = 0
 
     # Windows互換性最優先：ディレクトリエントリなしでファイルのみ追加
     # ファイルパスから自動的にディレクトリ構造が復元される
-    with zipfile.ZipFile(
-        output_zip, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True  # 大きなファイル対応
+    # 出力ファイルは大きめのバッファで開き、write()システムコールの回数を減らす
+    with open(output_zip, "wb", buffering=_WRITE_BUFFER_SIZE) as out, zipfile.ZipFile(
+        out, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True  # 大きなファイル対応
     ) as zf:
         # ファイルのみ追加（UTF-8フラグ付き）
-        for root, dirs, files in os.walk(source_dir):
-            for file in files:
-                file_path = Path(root) / file
-                arcname = file_path.relative_to(base_path).as_posix()
-
-                # ZipInfoを使ってUTF-8フラグを明示的に設定
-                zip_info = zipfile.ZipInfo.from_file(file_path, arcname)
-                zip_info.compress_type = zipfile.ZIP_DEFLATED
-                zip_info.flag_bits |= 0x800  # UTF-8フラグを強制設定
-
-                # ファイル内容を読み込んで追加
-                with open(file_path, "rb") as f:
-                    zf.writestr(zip_info, f.read(), compress_type=zipfile.ZIP_DEFLATED)
-
-                print(f"   ✓ {arcname}")
-                file_count += 1
+        for entry, arcname in _iter_files(str(source_dir), prefix):
+            _add_file(zf, entry.path, arcname, entry.stat())
+            log.debug("   ✓ %s", arcname)
+            file_count += 1
 
     # 圧縮結果の確認
     zip_size_mb = output_zip.stat().st_size / (1024 * 1024)
     print(f"   ✅ Compressed {file_count} files ({zip_size_mb:.2f} MB)\n")
 
 
+def _copy_range(src: BinaryIO, dst: BinaryIO, offset: int, length: int) -> None:
+    """
+    srcのoffsetからlengthバイトをdstの現在位置へコピー
+
+    Linuxではos.copy_file_rangeでカーネル内コピーする。
+    os.copy_file_rangeがない環境（macOSなど）や、別ファイルシステム間のコピーなどで
+    失敗した場合は、チャンク単位の通常コピーにフォールバックする。
+    """
+    done = 0
+    if hasattr(os, "copy_file_range"):
+        dst.flush()
+        dst_pos = dst.tell()
+        try:
+            while done < length:
+                copied = os.copy_file_range(
+                    src.fileno(), dst.fileno(), length - done, offset_src=offset + done, offset_dst=dst_pos + done
+                )
+                if copied == 0:
+                    raise EOFError(f"Unexpected end of file while copying {length} bytes")
+                done += copied
+        except OSError as e:
+            if e.errno not in _COPY_FILE_RANGE_FALLBACK_ERRNOS:
+                raise
+        dst.seek(dst_pos + done)
+        if done == length:
+            return
+
+    src.seek(offset + done)
+    remaining = length - done
+    while remaining:
+        chunk = src.read(min(remaining, _COPY_CHUNK_SIZE))
+        if not chunk:
+            raise EOFError(f"Unexpected end of file while copying {length} bytes")
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+def _extracted_arcname(filename: str) -> str:
+    """
+    エントリ名をextractall()が実際に書き出すパス（解凍先からの相対パス、"/"区切り）に正規化
+
+    ZipFile._extract_member()と同じく、ドライブ名・空要素・"."・".."を取り除く。
+    source_dirから求めた変更ファイルのアーカイブ名と元ZIPのエントリを対応付けるために使う。
+    """
+    arcname = filename.replace("/", os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid_path_parts = ("", os.path.curdir, os.path.pardir)
+    return "/".join(x for x in arcname.split(os.path.sep) if x not in invalid_path_parts)
+
+
+def _strip_zip64_extra(extra: bytes) -> bytes:
+    """拡張フィールドからZIP64拡張情報（ヘッダーID 0x0001）を取り除く"""
+    result = []
+    pos = 0
+    while pos + 4 <= len(extra):
+        header_id, size = struct.unpack_from("<HH", extra, pos)
+        end = pos + 4 + size
+        if header_id != 0x0001:
+            result.append(extra[pos:end])
+        pos = end
+    # 4バイトに満たない末尾の余りはそのまま残す（zipfileの扱いと同じ）
+    result.append(extra[pos:])
+    return b"".join(result)
+
+
+def _copy_raw_entry(src_zf: zipfile.ZipFile, dst_zf: zipfile.ZipFile, info: zipfile.ZipInfo, arcname: str) -> None:
+    """
+    圧縮済みデータを解凍・再圧縮せずにそのままコピー
+
+    zipfileには圧縮済みデータを直接書き込む公開APIがないため、
+    ローカルファイルヘッダーを書き出してからデータ部をコピーし、
+    セントラルディレクトリ用のZipInfoをdst_zfに登録する。
+
+    zipfileの非公開の内部実装（sizeFileHeader, stringFileHeader, ZipInfo.FileHeader(),
+    ZipFile.filelist/NameToInfo/start_dir/_didModify）に依存している。
+    CPython 3.11.7 / 3.12.1 / 3.13.0 で動作を確認済み。Pythonを更新する際は再確認すること。
+
+    Args:
+        src_zf: コピー元のZipFile
+        dst_zf: 書き込み中のZipFile
+        info: コピーするエントリ
+        arcname: 出力ZIPでのエントリ名（_extracted_arcname()で正規化したもの）
+    """
+    # ローカルファイルヘッダーの可変長部分はセントラルディレクトリと異なる場合があるため実際に読む
+    src_zf.fp.seek(info.header_offset)
+    header = src_zf.fp.read(zipfile.sizeFileHeader)
+    if header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad local file header: {info.filename}")
+    fname_len, extra_len = struct.unpack("<HH", header[26:30])
+    data_offset = info.header_offset + zipfile.sizeFileHeader + fname_len + extra_len
+
+    new_info = copy.copy(info)
+    # compress_directory()と同じく正規化した名前で格納（UTF-8フラグはFileHeader()が名前から判定）
+    new_info.filename = arcname
+    # データディスクリプタはコピーしないため、CRC・サイズはローカルヘッダーに書く
+    new_info.flag_bits &= ~0x08
+    # ZIP64拡張フィールドはFileHeader()が必要に応じて付け直すため、重複しないよう除去
+    new_info.extra = _strip_zip64_extra(info.extra)
+    new_info.header_offset = dst_zf.fp.tell()
+
+    dst_zf.fp.write(new_info.FileHeader())
+    _copy_range(src_zf.fp, dst_zf.fp, data_offset, info.compress_size)
+
+    dst_zf.filelist.append(new_info)
+    dst_zf.NameToInfo[new_info.filename] = new_info
+    dst_zf.start_dir = dst_zf.fp.tell()
+    dst_zf._didModify = True
+
+
+def merge_zip(
+    src_zip: Path,
+    dst_zip: Path,
+    source_dir: Path,
+    changed_arcnames: Iterable[str],
+    compress_type: Optional[int] = None,
+) -> None:
+    """
+    変更されたエントリのみ再圧縮し、それ以外は元ZIPの圧縮済みデータをそのままコピーして再作成
+
+    ネストしたZIPのうち一部（署名したxcframework.zipなど）だけが変わった場合、
+    未変更エントリの解凍・再圧縮を省略できる。
+
+    Args:
+        src_zip: 元のZIPファイル（source_dirはこのZIPを解凍したもの）
+        dst_zip: 出力ZIPファイルのパス（src_zipと同じ場合は置き換える）
+        source_dir: src_zipを解凍したディレクトリ
+        changed_arcnames: 変更・追加されたファイルのアーカイブ名（source_dirから読み込んで圧縮）
+        compress_type: 変更ファイルの圧縮方式（Noneの場合は内容から自動判定）
+
+    Example:
+        merge_zip(Path('コネクト_v1.0.0.zip'), Path('コネクト_v1.0.0.zip'), work_dir,
+                  ['コネクト_v1.0.0/コネクト_v1.0.0/aaa.xcframework.zip'])
+    """
+    source_dir = source_dir.resolve()
+    changed = set(changed_arcnames)
+    dst_zip.parent.mkdir(parents=True, exist_ok=True)
+
+    print(f"📦 Repacking: {src_zip.name}")
+    print(f"   → {dst_zip.name} ({len(changed)} changed)")
+
+    # 元ZIPを読みながら書くため、一時ファイルに書き出してから置き換える
+    tmp_zip = dst_zip.with_name(dst_zip.name + ".tmp")
+    copied_count = 0
+
+    try:
+        with zipfile.ZipFile(src_zip, "r") as src_zf, open(
+            tmp_zip, "wb", buffering=_WRITE_BUFFER_SIZE
+        ) as out, zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as dst_zf:
+            # 解凍後のパスで元エントリを対応付ける（"./"付きの名前などはextractall()で正規化されるため）
+            # ディレクトリエントリはcompress_directory()と同じく含めない（Windows互換性最優先）
+            # 同じパスに解凍されるエントリが複数ある場合は、extractall()で最後に書かれたものを残す
+            unchanged = {}
+            for info in src_zf.infolist():
+                arcname = _extracted_arcname(info.filename)
+                if arcname and not info.is_dir() and arcname not in changed:
+                    unchanged[arcname] = info
+
+            for arcname, info in unchanged.items():
+                _copy_raw_entry(src_zf, dst_zf, info, arcname)
+                log.debug("   ↪ %s", arcname)
+                copied_count += 1
+
+            for arcname in sorted(changed):
+                path = source_dir / arcname
+                _add_file(dst_zf, str(path), arcname, path.stat(), compress_type=compress_type)
+                log.debug("   ✓ %s", arcname)
+
+        os.replace(tmp_zip, dst_zip)
+    finally:
+        if tmp_zip.exists():
+            tmp_zip.unlink()
+
+    zip_size_mb = dst_zip.stat().st_size / (1024 * 1024)
+    print(f"   ✅ Copied {copied_count} entries, recompressed {len(changed)} files ({zip_size_mb:.2f} MB)\n")
+
+
 def add_signature_marker(target_dir: Path, marker_filename: str = "署名済み.txt") -> None:
     """
     署名済みマーカーファイルを追加
@@ -3,9 +3,11 @@
 テスト用のネストしたZIPファイルを作成
 
 使用方法:
-    python tests/create_test_fixture.py
+    python tests/create_test_fixture.py          # unsign/20260105_test.zip を作成
+    python tests/create_test_fixture.py --mixed  # tests/fixtures/20260105_mixed.zip を作成
 """
 
+import io
 import os
 import sys
 import zipfile
@@ -15,6 +17,9 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent / "scripts"))
 from zip_utils import verify_python_version
 
+# 生成したZIPが実行のたびに変わらないよう、固定のタイムスタンプを使う
+FIXTURE_DATE_TIME = (2026, 1, 5, 0, 0, 0)
+
 
 def create_test_zip(output_dir: Path = Path("unsign")):
     """
@@ -161,5 +166,91 @@ def create_test_zip(output_dir: Path = Path("unsign")):
             shutil.rmtree(work_dir)
 
 
+def _zip_bytes(entries) -> bytes:
+    """
+    (エントリ名, 内容)のリストからZIPをメモリ上に作成（内容がNoneの場合はディレクトリエントリ）
+
+    DEFLATEの出力はzlibの実装・バージョン（ZIP_USE_ISAL指定時のISA-Lなど）で変わるため、
+    どの環境で生成しても同じバイト列になるようSTOREDで格納する。
+    """
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for name, data in entries:
+            info = zipfile.ZipInfo(name, date_time=FIXTURE_DATE_TIME)
+            info.compress_type = zipfile.ZIP_STORED
+            if data is None:
+                info.external_attr = 0o40755 << 16 | 0x10
+                data = b''
+            else:
+                info.external_attr = 0o644 << 16
+            zf.writestr(info, data)
+    return buf.getvalue()
+
+
+def create_mixed_test_zip(output_dir: Path = Path("tests/fixtures")):
+    """
+    署名対象外のファイルを含むテスト用ZIPファイルを作成
+
+    xcframework.zip以外のエントリは再圧縮せずにそのままコピーされるため、
+    その経路（日本語ファイル名・ディレクトリエントリ・"./"付きのエントリ名）を確認する。
+
+    構造:
+    20260105_mixed.zip
+    ├── connect/                              （ディレクトリエントリ → 出力では除外）
+    ├── connect/ドキュメント/説明書.txt          （未変更 → そのままコピー）
+    └── connect/バイナリ/コネクト_v2.0.0.zip
+        ├── コネクト_v2.0.0/                   （ディレクトリエントリ → 出力では除外）
+        ├── コネクト_v2.0.0/リリースノート.txt   （未変更 → そのままコピー）
+        ├── コネクト_v2.0.0/画像/アイコン.png    （未変更 → そのままコピー）
+        ├── コネクト_v2.0.0/aaa.xcframework.zip （署名して置き換え）
+        └── ./コネクト_v2.0.0/bbb.xcframework.zip（署名して置き換え、名前は正規化）
+    """
+    verify_python_version()
+
+    print("🔨 Creating mixed test ZIP fixture...")
+    print()
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    xcframeworks = {}
+    for framework_name in ["aaa", "bbb"]:
+        xcframeworks[framework_name] = _zip_bytes([
+            (f"{framework_name}.xcframework/Info.plist",
+             f'<?xml version="1.0" encoding="UTF-8"?>\n'
+             f'<plist version="1.0">\n'
+             f'<dict>\n'
+             f'    <key>CFBundleIdentifier</key>\n'
+             f'    <string>com.example.{framework_name}</string>\n'
+             f'</dict>\n'
+             f'</plist>\n'.encode('utf-8')),
+            (f"{framework_name}.xcframework/ios-arm64/{framework_name}.framework/{framework_name}", b'\x00' * 1024),
+        ])
+
+    connect_zip = _zip_bytes([
+        ("コネクト_v2.0.0/", None),
+        ("コネクト_v2.0.0/リリースノート.txt", "v2.0.0 リリースノート\n".encode('utf-8') * 50),
+        ("コネクト_v2.0.0/画像/アイコン.png", bytes(range(256)) * 8),
+        ("コネクト_v2.0.0/aaa.xcframework.zip", xcframeworks["aaa"]),
+        ("./コネクト_v2.0.0/bbb.xcframework.zip", xcframeworks["bbb"]),
+    ])
+
+    root_zip_path = output_dir / "20260105_mixed.zip"
+    root_zip_path.write_bytes(_zip_bytes([
+        ("connect/", None),
+        ("connect/ドキュメント/説明書.txt", "このファイルは署名対象外です\n".encode('utf-8') * 50),
+        ("connect/バイナリ/コネクト_v2.0.0.zip", connect_zip),
+    ]))
+
+    size_kb = root_zip_path.stat().st_size / 1024
+    print(f"✅ Test fixture created: {root_zip_path} ({size_kb:.1f} KB)")
+    print()
+    print("🚀 Run test:")
+    print(f"   python scripts/process_zip.py {root_zip_path} /tmp/signed_mixed/")
+    print("   python tests/verify_zip_integrity.py --deep /tmp/signed_mixed/20260105_mixed.zip")
+
+
 if __name__ == "__main__":
-    create_test_zip()
+    if "--mixed" in sys.argv[1:]:
+        create_mixed_test_zip()
+    else:
+        create_test_zip()
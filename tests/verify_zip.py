@@ -4,11 +4,21 @@ ZIPファイルの完全性とWindows互換性を検証
 
 使用方法:
     python tests/verify_zip.py signed/20260105_test.zip
+    python tests/verify_zip.py signed/*.zip   # 複数ファイルは並列に検証
 """
 
+import contextlib
+import io
+import os
 import sys
+import traceback
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Tuple
+
+# 圧縮方式の表示名
+_COMPRESS_NAMES = {0: "STORED", 8: "DEFLATED"}
 
 
 def verify_zip_file(zip_path: Path) -> bool:
@@ -37,20 +47,23 @@ def verify_zip_file(zip_path: Path) -> bool:
                 print(f"   ❌ Invalid magic: {magic.hex()} (expected: {expected.hex()})")
                 return False
             
-            # 3. エントリ詳細
-            print(f"\n3. Entries ({len(zf.infolist())} total)...")
-            for info in zf.infolist():
-                utf8_flag = "UTF-8" if (info.flag_bits & 0x800) else "NO-UTF8"
-                compress_name = {
-                    0: "STORED",
-                    8: "DEFLATED"
-                }.get(info.compress_type, f"TYPE-{info.compress_type}")
+            # 3. エントリ詳細（1行ずつprintせず、まとめて1回で出力）
+            infos = zf.infolist()
+            print(f"\n3. Entries ({len(infos)} total)...")
+            lines = []
+            append = lines.append
+            for info in infos:
+                name = info.filename
+                flag = info.flag_bits
+                ct = info.compress_type
+                utf8_flag = "UTF-8" if (flag & 0x800) else "NO-UTF8"
+                compress_name = _COMPRESS_NAMES.get(ct) or f"TYPE-{ct}"
                 
                 # ディレクトリかファイルか
-                is_dir = info.filename.endswith('/')
-                entry_type = "[DIR]" if is_dir else "[FILE]"
+                entry_type = "[DIR]" if name.endswith('/') else "[FILE]"
                 
-                print(f"   {entry_type} {info.filename:50} [{utf8_flag}] [{compress_name}]")
+                append(f"   {entry_type} {name:50} [{utf8_flag}] [{compress_name}]\n")
+            sys.stdout.write("".join(lines))
             
             # 4. ファイルサイズ
             print(f"\n4. File size...")
@@ -63,23 +76,47 @@ def verify_zip_file(zip_path: Path) -> bool:
             
     except Exception as e:
         print(f"\n❌ Error: {e}")
-        import traceback
-        traceback.print_exc()
+        traceback.print_exception(e)
         return False
 
 
-if __name__ == "__main__":
+def _verify_zip_file_worker(zip_path: Path) -> Tuple[bool, str]:
+    """ワーカープロセスで検証し、出力をまとめて返す（複数ファイルの出力が混ざらないように）"""
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf), contextlib.redirect_stderr(buf):
+        success = verify_zip_file(zip_path)
+    return success, buf.getvalue()
+
+
+def main():
     if len(sys.argv) < 2:
-        print("Usage: python tests/verify_zip.py <zip_file>")
+        print("Usage: python tests/verify_zip.py <zip_file> [<zip_file> ...]")
         print()
         print("Example:")
         print("  python tests/verify_zip.py signed/20260105_test.zip")
+        print("  python tests/verify_zip.py signed/*.zip")
         sys.exit(1)
     
-    zip_path = Path(sys.argv[1])
-    if not zip_path.exists():
+    zip_paths = [Path(arg) for arg in sys.argv[1:]]
+    missing = [zip_path for zip_path in zip_paths if not zip_path.exists()]
+    for zip_path in missing:
         print(f"❌ File not found: {zip_path}")
+    if len(zip_paths) == 1 and missing:
         sys.exit(1)
+    zip_paths = [zip_path for zip_path in zip_paths if zip_path not in missing]
     
-    success = verify_zip_file(zip_path)
-    sys.exit(0 if success else 1)
+    if len(zip_paths) > 1:
+        # 複数ファイルはプロセスプールで並列に検証し、引数の順に出力
+        with ProcessPoolExecutor(max_workers=min(len(zip_paths), os.cpu_count() or 1)) as executor:
+            outcomes = list(executor.map(_verify_zip_file_worker, zip_paths))
+        for _, log in outcomes:
+            sys.stdout.write(log + "\n")
+        success = all(ok for ok, _ in outcomes)
+    else:
+        success = all(verify_zip_file(zip_path) for zip_path in zip_paths)
+    
+    sys.exit(0 if success and not missing else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,56 +4,171 @@ ZIPファイルの完全性検証ツール
 Windows環境で「有効なアーカイブではありません」エラーの原因を特定
 """
 
+import io
+import mmap
+import os
 import zipfile
 import struct
 import sys
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import repeat
 from pathlib import Path
+from typing import Optional, Tuple
+
+# CRC検証時の読み込みチャンクサイズ
+CRC_CHUNK_SIZE = 128 * 1024
+
+# EOCDの検索範囲（EOCD本体22バイト + 最大65535バイトのコメント）
+EOCD_SEARCH_SIZE = 22 + 65535
+
+# End of Central Directory record（固定長22バイト）の構造
+EOCD_STRUCT = struct.Struct("<IHHHHIIH")
+
+# ZIP64 End of Central Directory locator（EOCDの直前20バイト）とrecordの構造
+ZIP64_LOCATOR_STRUCT = struct.Struct("<IIQI")
+ZIP64_EOCD_STRUCT = struct.Struct("<IQHHIIQQQQ")
+
+
+def _read_zip64_eocd(mm: mmap.mmap, eocd_offset: int) -> Optional[Tuple[int, int, int, int]]:
+    """
+    ZIP64 EOCD locatorからZIP64 EOCD recordを読み、実際のCentral Directory情報を返す
+
+    Returns:
+        (エントリ数, Central Directoryのサイズ, Central Directoryのoffset, ZIP64 EOCD recordのoffset)
+        ZIP64の情報が見つからない場合はNone
+    """
+    locator_offset = eocd_offset - ZIP64_LOCATOR_STRUCT.size
+    if locator_offset < 0:
+        return None
+    signature, _, zip64_offset, _ = ZIP64_LOCATOR_STRUCT.unpack_from(mm, locator_offset)
+    if signature != 0x07064B50 or zip64_offset + ZIP64_EOCD_STRUCT.size > locator_offset:
+        return None
+
+    (signature, _, _, _, _, _, _, entries_total, cd_size, cd_offset) = ZIP64_EOCD_STRUCT.unpack_from(mm, zip64_offset)
+    if signature != 0x06064B50:
+        return None
+    return entries_total, cd_size, cd_offset, zip64_offset
+
+
+@dataclass(slots=True)
+class EntryInfo:
+    """エントリごとの検証結果（エントリ数が多くても軽量なように__slots__を使う）"""
+
+    filename: str
+    compress_type: int
+    compress_size: int
+    file_size: int
+    flag_bits: int
+    crc: int
+    crc_verified: bool = False
+
+
+def _compute_entry_crcs(zip_path: Path, infos: list) -> dict:
+    """
+    各エントリを展開してCRCを計算（スレッド並列）
+
+    zlibの展開とcrc32はGILを解放するため、エントリ単位でスレッドに分散すると並列に処理できる。
+    ZipFileのファイルハンドルはスレッド間で共有できないため、スレッドごとに1つ開いて使い回す。
+
+    Returns:
+        ZipInfo → 計算したCRC（int）または読み込み時の例外
+    """
+    local = threading.local()
+    opened = []
+
+    def _crc_one(info: zipfile.ZipInfo):
+        zf = getattr(local, "zf", None)
+        if zf is None:
+            zf = local.zf = zipfile.ZipFile(zip_path, "r")
+            opened.append(zf)
+        try:
+            crc = 0
+            with zf.open(info, "r") as fp:
+                while chunk := fp.read(CRC_CHUNK_SIZE):
+                    crc = zlib.crc32(chunk, crc)
+        except Exception as e:
+            return e
+        return crc & 0xFFFFFFFF
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(len(infos), os.cpu_count() or 1) or 1) as executor:
+            return dict(zip(infos, executor.map(_crc_one, infos)))
+    finally:
+        for zf in opened:
+            zf.close()
+
+
+def _check_entry_crc(info: zipfile.ZipInfo, calculated, errors: list) -> bool:
+    """_compute_entry_crcs()の結果をCentral DirectoryのCRCと照合"""
+    if isinstance(calculated, Exception):
+        errors.append(f"{info.filename}: 読み込みエラー - {calculated}")
+        return False
+
+    if calculated != info.CRC:
+        errors.append(f"{info.filename}: CRC不一致 " f"(期待={info.CRC:08x}, 実際={calculated:08x})")
+        return False
+    return True
 
 
-def verify_zip_structure(zip_path: Path) -> dict:
-    """ZIPファイルの構造を詳細に検証"""
+def verify_zip_structure(zip_path: Path, deep: bool = False) -> dict:
+    """
+    ZIPファイルの構造を詳細に検証
+
+    通常はtestzip()でCRCを検証し、deep=Trueの場合はtestzip()の代わりに各エントリを
+    スレッド並列で再展開してCRCを照合する。
+    """
     results = {"valid": False, "errors": [], "warnings": [], "details": {}}
+    # ループ内で毎回resultsを辞書参照しないようローカル変数に束縛
+    errors = results["errors"]
+    warnings = results["warnings"]
+    details = results["details"]
+    entries_out = details["entries"] = []
 
     try:
         # ファイルサイズチェック
         file_size = zip_path.stat().st_size
-        results["details"]["file_size"] = file_size
+        details["file_size"] = file_size
 
         if file_size < 22:  # 最小のZIPファイルサイズ（End of Central Directory）
-            results["errors"].append(f"ファイルサイズが小さすぎます: {file_size} bytes")
+            errors.append(f"ファイルサイズが小さすぎます: {file_size} bytes")
             return results
 
         # バイナリで読み込んで構造チェック
         with open(zip_path, "rb") as f:
-            # Local File Header確認
-            magic = f.read(4)
-            if magic != b"PK\x03\x04":
-                results["errors"].append(f"無効なZIPシグネチャ: {magic.hex()}")
-                return results
-
-            f.seek(0)
-            content = f.read()
-
-            # Central Directoryの位置を確認
-            if b"PK\x01\x02" not in content:
-                results["errors"].append("Central Directory File Headerが見つかりません")
-
-            # End of Central Directoryの位置を確認
-            if b"PK\x05\x06" not in content:
-                results["errors"].append("End of Central Directory recordが見つかりません")
-            else:
-                # End of Central Directoryを解析
-                eocd_offset = content.rfind(b"PK\x05\x06")
-                f.seek(eocd_offset)
-                eocd_data = f.read(22)
-
-                if len(eocd_data) == 22:
+            # ファイル全体を読み込まず、メモリマップ上で検索
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # Local File Header確認（別途read()せず、メモリマップの先頭4バイトを参照）
+                magic = bytes(mm[:4])
+                if magic != b"PK\x03\x04":
+                    errors.append(f"無効なZIPシグネチャ: {magic.hex()}")
+                    return results
+
+                # End of Central Directoryの位置を確認
+                # コメントなしのZIP（zipfileで作成したもの）ではEOCDは末尾22バイトちょうどにあるため先に照合し、
+                # 見つからない場合のみ末尾の22+65535バイト以内（仕様上の範囲）を検索
+                eocd_offset = file_size - EOCD_STRUCT.size
+                if mm[eocd_offset : eocd_offset + 4] != b"PK\x05\x06":
+                    eocd_offset = mm.rfind(b"PK\x05\x06", max(0, file_size - EOCD_SEARCH_SIZE))
+                if eocd_offset == -1:
+                    errors.append("End of Central Directory recordが見つかりません")
+                elif eocd_offset + EOCD_STRUCT.size <= file_size:
                     # EOCD構造を解析
                     (signature, disk_num, disk_start, entries_disk, entries_total, cd_size, cd_offset, comment_len) = (
-                        struct.unpack("<IHHHHIIH", eocd_data)
+                        EOCD_STRUCT.unpack_from(mm, eocd_offset)
                     )
 
-                    results["details"]["eocd"] = {
+                    # ZIP64の場合、実際の値はEOCDの直前にあるZIP64 EOCD recordにある
+                    # （EOCDの値は0xFFFF/0xFFFFFFFFになっている場合がある）
+                    cd_end = eocd_offset
+                    is_zip64 = entries_total == 0xFFFF or cd_size == 0xFFFFFFFF or cd_offset == 0xFFFFFFFF
+                    zip64 = _read_zip64_eocd(mm, eocd_offset)
+                    if zip64 is not None:
+                        entries_total, cd_size, cd_offset, cd_end = zip64
+
+                    details["eocd"] = {
                         "offset": eocd_offset,
                         "entries_total": entries_total,
                         "central_dir_size": cd_size,
@@ -61,129 +176,150 @@ def verify_zip_structure(zip_path: Path) -> dict:
                         "comment_length": comment_len,
                     }
 
-                    # Central Directoryの位置が正しいか確認
-                    if cd_offset + cd_size != eocd_offset:
-                        results["warnings"].append(
-                            f"Central Directoryの位置が不正: " f"offset={cd_offset}, size={cd_size}, eocd={eocd_offset}"
-                        )
-
-        # zipfileモジュールで読み込みテスト
-        with zipfile.ZipFile(zip_path, "r") as zf:
-            # testzip()で整合性確認
-            bad_file = zf.testzip()
-            if bad_file:
-                results["errors"].append(f"破損したファイル: {bad_file}")
-            else:
-                results["valid"] = True
-
-            # 各エントリの検証
-            results["details"]["entries"] = []
-            for info in zf.infolist():
-                entry_info = {
-                    "filename": info.filename,
-                    "compress_type": info.compress_type,
-                    "compress_size": info.compress_size,
-                    "file_size": info.file_size,
-                    "flag_bits": f"0x{info.flag_bits:04x}",
-                    "crc": f"0x{info.CRC:08x}",
-                }
-
-                # 圧縮率チェック
-                if info.file_size > 0:
-                    ratio = info.compress_size / info.file_size
-                    if ratio > 1.0:
-                        results["warnings"].append(f"{info.filename}: 圧縮後のサイズが大きい ({ratio:.2f})")
-
-                # CRCの検証（実際に読み込んで確認）
-                try:
-                    data = zf.read(info.filename)
-                    import zlib
-
-                    calculated_crc = zlib.crc32(data) & 0xFFFFFFFF
-                    if calculated_crc != info.CRC:
-                        results["errors"].append(
-                            f"{info.filename}: CRC不一致 " f"(期待={info.CRC:08x}, 実際={calculated_crc:08x})"
-                        )
-                    entry_info["crc_verified"] = True
-                except Exception as e:
-                    results["errors"].append(f"{info.filename}: 読み込みエラー - {e}")
-                    entry_info["crc_verified"] = False
-
-                results["details"]["entries"].append(entry_info)
+                    # ZIP64 EOCD recordが読めない場合は位置を特定できないため、以下の構造チェックは行わない
+                    if not is_zip64 or zip64 is not None:
+                        # Central Directory File Headerはcd_offsetの位置にあるはずなので、全体を検索せずその4バイトだけ照合
+                        if mm[cd_offset : cd_offset + 4] != b"PK\x01\x02":
+                            errors.append("Central Directory File Headerが見つかりません")
+
+                        # Central Directoryの位置が正しいか確認
+                        if cd_offset + cd_size != cd_end:
+                            warnings.append(
+                                f"Central Directoryの位置が不正: " f"offset={cd_offset}, size={cd_size}, eocd={cd_end}"
+                            )
+
+            # zipfileモジュールで読み込みテスト（開き直さず、同じファイルオブジェクトを渡す）
+            f.seek(0)
+            with zipfile.ZipFile(f, "r") as zf:
+                infos = zf.infolist()
+                if deep:
+                    # testzip()も全エントリを展開してCRCを照合するため、deep指定時は呼ばずに
+                    # 全エントリのCRCをスレッド並列で計算して照合する（展開処理を二重に行わない）
+                    bad_file = None
+                    crcs = _compute_entry_crcs(zip_path, [info for info in infos if not info.is_dir()])
+                else:
+                    # testzip()で整合性確認
+                    bad_file = zf.testzip()
+                    if bad_file:
+                        errors.append(f"破損したファイル: {bad_file}")
+                    crcs = {}
+
+                # 各エントリの検証（ZipInfoの属性は1回だけ読み出してローカル変数で扱う）
+                no_bad_file = bad_file is None
+                for info in infos:
+                    name = info.filename
+                    compress_size = info.compress_size
+                    file_size = info.file_size
+
+                    # 圧縮率チェック
+                    if file_size > 0:
+                        ratio = compress_size / file_size
+                        if ratio > 1.0:
+                            warnings.append(f"{name}: 圧縮後のサイズが大きい ({ratio:.2f})")
+
+                    # CRCの検証（deep指定時は再展開した結果、それ以外はtestzip()の結果を使う）
+                    calculated = crcs.get(info)
+                    crc_ok = no_bad_file if calculated is None else _check_entry_crc(info, calculated, errors)
+
+                    entries_out.append(
+                        EntryInfo(name, info.compress_type, compress_size, file_size, info.flag_bits, info.CRC, crc_ok)
+                    )
+
+                results["valid"] = all(entry.crc_verified for entry in entries_out)
 
     except zipfile.BadZipFile as e:
-        results["errors"].append(f"BadZipFile: {e}")
+        errors.append(f"BadZipFile: {e}")
     except Exception as e:
-        results["errors"].append(f"予期しないエラー: {e}")
+        errors.append(f"予期しないエラー: {e}")
 
     return results
 
 
 def print_results(zip_path: Path, results: dict):
-    """検証結果を表示"""
-    print("=" * 70)
-    print(f"ZIP整合性検証: {zip_path.name}")
-    print("=" * 70)
+    """検証結果を表示（出力をバッファにまとめ、最後に1回で書き出す）"""
+    buf = io.StringIO()
+    w = buf.write
+    w("=" * 70 + "\n")
+    w(f"ZIP整合性検証: {zip_path.name}\n")
+    w("=" * 70 + "\n")
 
     # 基本情報
-    print(f"\n📋 基本情報:")
-    print(f"  ファイルパス: {zip_path}")
-    print(f"  ファイルサイズ: {results['details'].get('file_size', 0):,} bytes")
+    w(f"\n📋 基本情報:\n")
+    w(f"  ファイルパス: {zip_path}\n")
+    w(f"  ファイルサイズ: {results['details'].get('file_size', 0):,} bytes\n")
 
     # EOCDの情報
     if "eocd" in results["details"]:
         eocd = results["details"]["eocd"]
-        print(f"\n📦 End of Central Directory:")
-        print(f"  エントリ数: {eocd['entries_total']}")
-        print(f"  Central Directory offset: {eocd['central_dir_offset']}")
-        print(f"  Central Directory size: {eocd['central_dir_size']}")
-        print(f"  EOCD offset: {eocd['offset']}")
+        w(f"\n📦 End of Central Directory:\n")
+        w(f"  エントリ数: {eocd['entries_total']}\n")
+        w(f"  Central Directory offset: {eocd['central_dir_offset']}\n")
+        w(f"  Central Directory size: {eocd['central_dir_size']}\n")
+        w(f"  EOCD offset: {eocd['offset']}\n")
 
     # エントリ情報
     if results["details"].get("entries"):
-        print(f"\n📄 エントリ詳細:")
+        w(f"\n📄 エントリ詳細:\n")
         for entry in results["details"]["entries"]:
-            crc_status = "✅" if entry.get("crc_verified") else "❌"
-            print(f"  {crc_status} {entry['filename']}")
-            print(f"     圧縮: {entry['compress_size']:,} bytes → {entry['file_size']:,} bytes")
-            print(f"     CRC: {entry['crc']}, Flags: {entry['flag_bits']}")
+            crc_status = "✅" if entry.crc_verified else "❌"
+            w(f"  {crc_status} {entry.filename}\n")
+            w(f"     圧縮: {entry.compress_size:,} bytes → {entry.file_size:,} bytes\n")
+            w(f"     CRC: 0x{entry.crc:08x}, Flags: 0x{entry.flag_bits:04x}\n")
 
     # 警告
     if results["warnings"]:
-        print(f"\n⚠️  警告 ({len(results['warnings'])}件):")
+        w(f"\n⚠️  警告 ({len(results['warnings'])}件):\n")
         for warning in results["warnings"]:
-            print(f"  - {warning}")
+            w(f"  - {warning}\n")
 
     # エラー
     if results["errors"]:
-        print(f"\n❌ エラー ({len(results['errors'])}件):")
+        w(f"\n❌ エラー ({len(results['errors'])}件):\n")
         for error in results["errors"]:
-            print(f"  - {error}")
+            w(f"  - {error}\n")
 
     # 結論
-    print(f"\n{'='*70}")
+    w(f"\n{'='*70}\n")
     if results["valid"] and not results["errors"]:
-        print("✅ ZIPファイルは正常です")
+        w("✅ ZIPファイルは正常です\n")
     else:
-        print("❌ ZIPファイルに問題があります")
-    print("=" * 70)
+        w("❌ ZIPファイルに問題があります\n")
+    w("=" * 70 + "\n")
+
+    sys.stdout.write(buf.getvalue())
 
 
 def main():
     """メイン処理"""
-    if len(sys.argv) < 2:
-        print(f"使用方法: {sys.argv[0]} <zipfile>")
+    args = [arg for arg in sys.argv[1:] if arg != "--deep"]
+    # --deep または環境変数 VERIFY_DEEP=1 で各エントリのCRCを再計算（"0"・"false"・空文字は無効）
+    deep = len(args) < len(sys.argv) - 1 or os.environ.get("VERIFY_DEEP", "") not in ("", "0", "false")
+
+    if not args:
+        print(f"使用方法: {sys.argv[0]} [--deep] <zipfile> [<zipfile> ...]")
         sys.exit(1)
 
-    zip_path = Path(sys.argv[1])
-    if not zip_path.exists():
+    zip_paths = [Path(arg) for arg in args]
+    missing = [zip_path for zip_path in zip_paths if not zip_path.exists()]
+    for zip_path in missing:
         print(f"エラー: ファイルが見つかりません: {zip_path}")
+    if len(zip_paths) == 1 and missing:
         sys.exit(1)
+    zip_paths = [zip_path for zip_path in zip_paths if zip_path not in missing]
+
+    if len(zip_paths) > 1:
+        # 複数ファイルは互いに独立しているため、プロセスプールで並列に検証（表示は引数の順）
+        with ProcessPoolExecutor(max_workers=min(len(zip_paths), os.cpu_count() or 1)) as executor:
+            all_results = list(executor.map(verify_zip_structure, zip_paths, repeat(deep)))
+    else:
+        all_results = [verify_zip_structure(zip_path, deep=deep) for zip_path in zip_paths]
 
-    results = verify_zip_structure(zip_path)
-    print_results(zip_path, results)
+    all_ok = not missing
+    for zip_path, results in zip(zip_paths, all_results):
+        print_results(zip_path, results)
+        all_ok = all_ok and results["valid"] and not results["errors"]
 
-    sys.exit(0 if results["valid"] and not results["errors"] else 1)
+    sys.exit(0 if all_ok else 1)
 
 
 if __name__ == "__main__":